@@ -1,7 +1,48 @@
 import ast
+import hashlib
 import io
+import re
+import threading
 import tokenize
 import keyword
+from collections import OrderedDict
+
+_RESERVED = frozenset(keyword.kwlist)
+
+# A non-blank line; group 1 is the line with leading and trailing whitespace stripped.
+_NON_BLANK_LINE_RE = re.compile(r"(?m)^[^\S\n]*(\S(?:.*\S)?)")
+
+# Breakdowns of recently analyzed sources, keyed by a 128-bit BLAKE2b digest of the code.
+_CACHE = OrderedDict()
+_CACHE_MAX_SIZE = 256
+# Guards every read and update of _CACHE; analyze_style may run on several threads.
+_CACHE_LOCK = threading.Lock()
+
+# *** Conversion parameters ***
+# One (max_mark, lo, lotol, hitol, hi) row per measure, in measure order.
+_PARAMS = (
+    # 1. Average line length (ideal: between 50 and 70, bounds: 40 and 90, max mark = 15)
+    (15, 40, 50, 70, 90),
+    # 2. Comment percentage (ideal: 10%-20%, bounds: 5%-30%, max mark = 10)
+    (10, 5, 10, 20, 30),
+    # 3. Indentation percentage (ideal: 40%-60%, bounds: 30%-70%, max mark = 12)
+    (12, 30, 40, 60, 70),
+    # 4. Blank lines percentage (ideal: 5%-10%, bounds: 2%-15%, max mark = 5)
+    (5, 2, 5, 10, 15),
+    # 5. Embedded space percentage (ideal: 7%-12%, bounds: 5%-15%, max mark = 8)
+    (8, 5, 7, 12, 15),
+    # 6. Module length (average lines per module; ideal: between 10 and 20, bounds: 5 and 30, max mark = 20)
+    (20, 5, 10, 20, 30),
+    # 7. Variety of reserved words (ideal: between 8 and 15 distinct keywords, bounds: 5 and 20, max mark = 10)
+    (10, 5, 8, 15, 20),
+    # 8. Average identifier length (ideal: between 7 and 15, bounds: 5 and 20, max mark = 20)
+    (20, 5, 7, 15, 20),
+)
+
+def clear_cache():
+    """Discard all cached style breakdowns."""
+    with _CACHE_LOCK:
+        _CACHE.clear()
 
 def conversion(measure_value, params):
     """Convert a measured value into a mark according to a conversion curve.
@@ -19,16 +60,148 @@ def conversion(measure_value, params):
       A mark (between 0 and max_mark) for this measure.
     """
     max_mark, lo, lotol, hitol, hi = params
-    if measure_value < lo or measure_value > hi:
-        return 0
-    elif lotol <= measure_value <= hitol:
-        return max_mark
-    elif lo <= measure_value < lotol:
-        return max_mark * (measure_value - lo) / (lotol - lo)
-    elif hitol < measure_value <= hi:
-        return max_mark * (hi - measure_value) / (hi - hitol)
+    # The curve is the minimum of a rising ramp (lo -> lotol) and a falling
+    # ramp (hitol -> hi), clamped to [0, 1]. Outside [lo, hi] one of the ramps
+    # is negative, so no separate range checks are needed. A vertical edge
+    # (lo == lotol or hitol == hi) degenerates into a step.
+    left = (measure_value - lo) / (lotol - lo) if lotol > lo else float(measure_value >= lo)
+    right = (hi - measure_value) / (hi - hitol) if hi > hitol else float(measure_value <= hi)
+    return max_mark * max(0.0, min(1.0, left, right))
+
+def _make_conversion(params):
+    """Return `conversion` specialized for fixed `params`.
+    
+    The parameters are bound once and the ramp slopes are stored as
+    reciprocals, so each call is two multiplications and a clamp.
+    """
+    max_mark, lo, lotol, hitol, hi = params
+    if not (lo < lotol and hitol < hi):
+        # Vertical edges have no finite slope; use the general curve.
+        return lambda measure_value: conversion(measure_value, params)
+    inv_left = 1.0 / (lotol - lo)
+    inv_right = 1.0 / (hi - hitol)
+
+    def convert(measure_value):
+        return max_mark * max(0.0, min(1.0, (measure_value - lo) * inv_left, (hi - measure_value) * inv_right))
+    return convert
+
+# One specialized conversion per measure, in the order of _PARAMS.
+_CONVERTERS = tuple(_make_conversion(params) for params in _PARAMS)
+
+def _scan_lines(code):
+    """Collect the per-line counts behind measures 1-6 in one scan of `code`.
+    
+    Returns:
+      A tuple (total_lines, non_blank_lines, significant_chars, embedded_spaces,
+      indented_lines, blank_lines).
+    """
+    # Lines are delimited by "\n"; a final line without a newline still counts.
+    total_lines = code.count("\n") + (1 if code and not code.endswith("\n") else 0)
+
+    # Single regex pass over the non-blank lines, without splitting the source
+    # into a list. Indented and blank lines are derived from the same matches.
+    # Lengths and spaces are taken from the span of the stripped line in `code`
+    # itself, so no stripped copy of the line is built.
+    n_non_blank = 0
+    indented_count = 0
+    total_chars = 0
+    total_embedded_spaces = 0
+    for match in _NON_BLANK_LINE_RE.finditer(code):
+        start, end = match.span(1)
+        n_non_blank += 1
+        total_chars += end - start
+        total_embedded_spaces += code.count(" ", start, end)
+        # A matched line is never empty, so its first character always exists.
+        first = code[match.start()]
+        if first == " " or first == "\t":
+            indented_count += 1
+    blank_count = total_lines - n_non_blank
+    return (total_lines, n_non_blank, total_chars, total_embedded_spaces,
+            indented_count, blank_count)
+
+def _scan_tokens(code):
+    """Collect the token-based counts behind measures 2, 6, 7 and 8 in one pass.
+    
+    Returns:
+      A tuple (comment_lines, reserved_words_used, identifiers,
+      identifier_length_sum, function_defs), or None if `code` cannot be tokenized.
+    """
+    reserved_words_set = _RESERVED
+    # A comment runs to the end of its line, so each COMMENT token is on a
+    # distinct line and counting tokens counts commented lines.
+    comment_line_count = 0
+    used_reserved_words = set()
+    identifier_count = 0
+    identifier_length_sum = 0
+    # Function definitions are counted from the same stream: a "def" keyword
+    # that starts a logical line (optionally after "async").
+    num_funcs = 0
+    at_statement_start = True
+    # Token types as locals, so the per-token comparisons avoid attribute lookups.
+    NAME = tokenize.NAME
+    COMMENT = tokenize.COMMENT
+    NL = tokenize.NL
+    # ENCODING is the first token of a bytes stream and precedes the first statement.
+    statement_boundaries = frozenset((tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT, tokenize.ENCODING))
+    if isinstance(code, bytes):
+        tokens = tokenize.tokenize(io.BytesIO(code).readline)
     else:
+        tokens = tokenize.generate_tokens(io.StringIO(code).readline)
+    try:
+        for tok in tokens:
+            # Dispatch in order of frequency; only NAME and COMMENT carry measures.
+            tok_type = tok.type
+            if tok_type == NAME:
+                name = tok.string
+                if name in reserved_words_set:
+                    used_reserved_words.add(name)
+                    if name == "def" and at_statement_start:
+                        num_funcs += 1
+                else:
+                    identifier_count += 1
+                    identifier_length_sum += len(name)
+                at_statement_start = at_statement_start and name == "async"
+            elif tok_type == COMMENT:
+                comment_line_count += 1
+            elif tok_type != NL:
+                at_statement_start = tok_type in statement_boundaries
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    return (comment_line_count, len(used_reserved_words), identifier_count,
+            identifier_length_sum, num_funcs)
+
+class _DefCounter(ast.NodeVisitor):
+    """Count (async) function definitions in an AST.
+    
+    Definitions can only occur among statements, so only statement bodies are
+    descended into; expression subtrees are never visited.
+    """
+
+    _BODY_FIELDS = ("body", "orelse", "finalbody", "handlers", "cases")
+
+    def __init__(self):
+        self.count = 0
+
+    def generic_visit(self, node):
+        for field in self._BODY_FIELDS:
+            for child in getattr(node, field, ()):
+                self.visit(child)
+
+    def visit_FunctionDef(self, node):
+        self.count += 1
+        self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+def _count_defs_ast(code):
+    """Count function definitions via the AST; 0 if `code` does not parse."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
         return 0
+    counter = _DefCounter()
+    counter.visit(tree)
+    return counter.count
 
 def analyze_style(code):
     """Analyze the style of a Python program by Michael Rees algorithm.
@@ -41,7 +214,7 @@ def analyze_style(code):
       4. Percentage of blank lines (lines that are empty or only whitespace).
       5. Embedded spaces: the overall percentage of spaces within stripped lines.
       6. Module (function) length: calculated as the average number of non-blank lines per module.
-         A module here is defined as either a function (found via the AST) or the top‐level code.
+         A module here is defined as either a function (found via the token stream) or the top‐level code.
       7. Variety of reserved words: the number of distinct Python keywords used.
       8. Average identifier length: average length of programmer-defined names (excluding keywords).
       
@@ -50,106 +223,121 @@ def analyze_style(code):
     Each measure is then converted to a mark via a parameterized conversion curve.
     The total style mark is the sum of the converted marks (with measure 10 subtracted).
     
+    Results are cached by a BLAKE2b digest of the source, so analyzing the
+    same code again skips tokenization entirely. Each call returns its own
+    copy of the breakdown; use clear_cache() to release the cached results.
+    
     Parameters:
-      code: A string containing the Python source code.
+      code: A string containing the Python source code, or the raw bytes of a
+            source file (decoded according to its BOM or coding cookie).
     
     Returns:
       A dictionary with raw measure values, the mark obtained for each measure,
       and the overall style mark (out of 100).
     """
-    lines = code.splitlines()
-    total_lines = len(lines)
-    non_blank_lines = [line for line in lines if line.strip() != ""]
-    n_non_blank = len(non_blank_lines)
-    
+    # The input type is part of the key: bytes are decoded by their coding
+    # cookie, so they need not analyze like the str with the same UTF-8 form.
+    if isinstance(code, bytes):
+        digest = hashlib.blake2b(b"b", digest_size=16)
+        digest.update(code)
+    else:
+        digest = hashlib.blake2b(b"s", digest_size=16)
+        # surrogatepass: the encoding only feeds the hash, and str sources
+        # read with errors='surrogateescape' may hold lone surrogates.
+        digest.update(code.encode('utf-8', 'surrogatepass'))
+    key = digest.digest()
+    with _CACHE_LOCK:
+        breakdown = _CACHE.get(key)
+        if breakdown is not None:
+            _CACHE.move_to_end(key)
+    if breakdown is None:
+        # Analyze outside the lock so other threads are not serialized on it.
+        breakdown = _analyze_style(code)
+        with _CACHE_LOCK:
+            _CACHE[key] = breakdown
+            if len(_CACHE) > _CACHE_MAX_SIZE:
+                _CACHE.popitem(last=False)
+    return {
+        "raw_measures": dict(breakdown["raw_measures"]),
+        "marks": dict(breakdown["marks"]),
+        "total_mark": breakdown["total_mark"],
+    }
+
+def _analyze_style(code):
+    """Compute the style breakdown of `code` without consulting the cache."""
+    # Bytes are tokenized as they are; only the line scan needs the text.
+    if isinstance(code, bytes):
+        if b"\r" in code:
+            # Apply the universal-newline translation that reading in text
+            # mode would have done, so CR-only files are split into lines.
+            code = code.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        tokens_source = code
+        try:
+            encoding, _ = tokenize.detect_encoding(io.BytesIO(code).readline)
+        except SyntaxError:
+            # An unknown or conflicting coding cookie cannot be tokenized;
+            # the line measures are still taken from the UTF-8 text.
+            encoding, tokens_source = "utf-8", None
+        text = code.decode(encoding)
+    else:
+        if "\r" in code:
+            # Same translation for text: CR-only sources are valid Python.
+            code = code.replace("\r\n", "\n").replace("\r", "\n")
+        tokens_source = code
+        text = code
+    (total_lines, n_non_blank, total_chars, total_embedded_spaces,
+     indented_count, blank_count) = _scan_lines(text)
+
     # Measure 1: Average line length (significant characters)
-    if n_non_blank > 0:
-        avg_line_length = sum(len(line.strip()) for line in non_blank_lines) / n_non_blank
+    avg_line_length = (total_chars / n_non_blank) if n_non_blank > 0 else 0
+
+    # Measures 2, 6, 7 (variety of reserved words) and 8 come from a single
+    # pass over the token stream.
+    # Code that cannot be tokenized contributes no token measures.
+    token_counts = _scan_tokens(tokens_source) if tokens_source is not None else None
+    if token_counts is None:
+        comment_line_count = reserved_words_count = identifier_count = identifier_length_sum = 0
+        num_funcs = _count_defs_ast(text)
     else:
-        avg_line_length = 0
+        (comment_line_count, reserved_words_count, identifier_count,
+         identifier_length_sum, num_funcs) = token_counts
 
-    # Use tokenize to get comment tokens and to later analyze names.
-    comment_lines = set()
-    try:
-        tokens = list(tokenize.tokenize(io.BytesIO(code.encode('utf-8')).readline))
-        for tok in tokens:
-            if tok.type == tokenize.COMMENT:
-                # Record the line number where the comment appears.
-                comment_lines.add(tok.start[0])
-    except Exception:
-        tokens = []
-    
     # Measure 2: Comment percentage (percentage of total lines that contain comments)
-    comment_percentage = (len(comment_lines) / total_lines * 100) if total_lines > 0 else 0
+    comment_percentage = (comment_line_count / total_lines * 100) if total_lines > 0 else 0
 
     # Measure 3: Indentation percentage (of non-blank lines, those that start with whitespace)
-    indented_lines = [line for line in non_blank_lines if line.startswith(" ") or line.startswith("\t")]
-    indent_percentage = (len(indented_lines) / n_non_blank * 100) if n_non_blank > 0 else 0
+    indent_percentage = (indented_count / n_non_blank * 100) if n_non_blank > 0 else 0
 
     # Measure 4: Blank lines percentage
-    blank_lines = [line for line in lines if line.strip() == ""]
-    blank_percentage = (len(blank_lines) / total_lines * 100) if total_lines > 0 else 0
+    blank_percentage = (blank_count / total_lines * 100) if total_lines > 0 else 0
 
     # Measure 5: Embedded spaces percentage.
     # For each non-blank line (after stripping), count the spaces.
-    total_embedded_spaces = sum(line.strip().count(" ") for line in non_blank_lines)
-    total_chars = sum(len(line.strip()) for line in non_blank_lines)
     embedded_space_percentage = (total_embedded_spaces / total_chars * 100) if total_chars > 0 else 0
 
     # Measure 6: Module (function) length.
-    # Count the number of function definitions using the AST.
-    try:
-        tree = ast.parse(code)
-        func_defs = [node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
-        num_funcs = len(func_defs)
-    except Exception as e:
-        num_funcs = 0
+    # Function definitions were counted while tokenizing; the AST is only
+    # consulted when the token stream could not be produced.
     # Define "modules" as functions plus the top-level module.
     modules = num_funcs + 1
     module_length = (n_non_blank / modules) if modules > 0 else n_non_blank
 
-    # Measure 7: Variety of reserved words.
-    reserved_words_set = set(keyword.kwlist)
-    used_reserved_words = set()
-    for tok in tokens:
-        if tok.type == tokenize.NAME and tok.string in reserved_words_set:
-            used_reserved_words.add(tok.string)
-    reserved_words_count = len(used_reserved_words)
-
     # Measure 8: Average identifier length (for programmer-defined identifiers, i.e. non-keyword names).
-    identifiers = [tok.string for tok in tokens if tok.type == tokenize.NAME and tok.string not in reserved_words_set]
-    avg_identifier_length = (sum(len(name) for name in identifiers) / len(identifiers)) if identifiers else 0
+    avg_identifier_length = (identifier_length_sum / identifier_count) if identifier_count else 0
 
 
-    # *** Conversion parameters ***
-    # (Each tuple is: (max_mark, lo, lotol, hitol, hi))
-
-    # 1. Average line length (ideal: between 50 and 70, bounds: 40 and 90, max mark = 15)
-    p1 = (15, 40, 50, 70, 90)
-    # 2. Comment percentage (ideal: 10%-20%, bounds: 5%-30%, max mark = 10)
-    p2 = (10, 5, 10, 20, 30)
-    # 3. Indentation percentage (ideal: 40%-60%, bounds: 30%-70%, max mark = 12)
-    p3 = (12, 30, 40, 60, 70)
-    # 4. Blank lines percentage (ideal: 5%-10%, bounds: 2%-15%, max mark = 5)
-    p4 = (5, 2, 5, 10, 15)
-    # 5. Embedded space percentage (ideal: 7%-12%, bounds: 5%-15%, max mark = 8)
-    p5 = (8, 5, 7, 12, 15)
-    # 6. Module length (average lines per module; ideal: between 10 and 20, bounds: 5 and 30, max mark = 20)
-    p6 = (20, 5, 10, 20, 30)
-    # 7. Variety of reserved words (ideal: between 8 and 15 distinct keywords, bounds: 5 and 20, max mark = 10)
-    p7 = (10, 5, 8, 15, 20)
-    # 8. Average identifier length (ideal: between 7 and 15, bounds: 5 and 20, max mark = 20)
-    p8 = (20, 5, 7, 15, 20)
-    
-    # Compute the marks for each measure using the conversion function.
-    m1 = conversion(avg_line_length, p1)
-    m2 = conversion(comment_percentage, p2)
-    m3 = conversion(indent_percentage, p3)
-    m4 = conversion(blank_percentage, p4)
-    m5 = conversion(embedded_space_percentage, p5)
-    m6 = conversion(module_length, p6)
-    m7 = conversion(reserved_words_count, p7)
-    m8 = conversion(avg_identifier_length, p8)
+    # Compute the marks for all measures with their specialized conversions.
+    measures = (
+        avg_line_length,
+        comment_percentage,
+        indent_percentage,
+        blank_percentage,
+        embedded_space_percentage,
+        module_length,
+        reserved_words_count,
+        avg_identifier_length,
+    )
+    m1, m2, m3, m4, m5, m6, m7, m8 = (convert(value) for convert, value in zip(_CONVERTERS, measures))
     
     # The overall style mark is the sum of marks for measures 1-8 minus measure 10.
     total_mark = m1 + m2 + m3 + m4 + m5 + m6 + m7 + m8 
@@ -188,7 +376,9 @@ if __name__ == "__main__":
     else:
         file_path = sys.argv[1]
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
+            # Read raw bytes: the tokenizer consumes them directly, so the
+            # source is never re-encoded.
+            with open(file_path, "rb") as f:
                 code = f.read()
             result = analyze_style(code)
             print("Style Analysis Breakdown:")